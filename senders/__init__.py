@@ -5,24 +5,33 @@ Senders package for ECS 152A congestion control project.
 
 # Use *relative* imports so this works both locally and inside Docker
 from .base_sender import BaseSender
-from .metrics import RTTTracker, TransferMetrics
+from .metrics import RingStats, RTTTracker, TransferMetrics
 from .packet_utils import (
+    ACK_MSG,
+    FIN_PREFIX,
     MSS,
     PACKET_SIZE,
     SEQ_ID_SIZE,
+    PacketBuilder,
     make_packet,
     parse_ack,
+    parse_ack_id,
     validate_packet,
 )
 
 __all__ = [
     "BaseSender",
+    "RingStats",
     "RTTTracker",
     "TransferMetrics",
+    "ACK_MSG",
+    "FIN_PREFIX",
     "MSS",
     "PACKET_SIZE",
     "SEQ_ID_SIZE",
+    "PacketBuilder",
     "make_packet",
     "parse_ack",
+    "parse_ack_id",
     "validate_packet",
 ]
@@ -7,15 +7,87 @@ Handles socket setup, file loading, metrics - algorithms just implement send_pac
 
 from __future__ import annotations
 
+import ctypes
+import ctypes.util
 import os
+import select
+import selectors
+import signal
 import socket
 import sys
 import time
 from abc import ABC, abstractmethod
-from typing import List, Optional, Tuple
+from collections import deque
+from typing import List, Optional, Sequence, Tuple
 
 from senders.metrics import RTTTracker, TransferMetrics
-from senders.packet_utils import MSS, PACKET_SIZE, make_packet, parse_ack
+from senders.packet_utils import (
+    FIN_PREFIX,
+    MSS,
+    PACKET_SIZE,
+    SEQ_ID_SIZE,
+    PacketBuilder,
+    make_packet,
+    parse_ack,
+    parse_ack_id,
+)
+
+# max packets per sendmmsg() call - gains flatten out past ~100
+MAX_BATCH = 64
+
+# socket buffer size we ask for - the default ~208 KB overflows when cwnd bursts
+SOCK_BUF_SIZE = 4 * 1024 * 1024
+
+# debug log lines kept in memory until the transfer ends - past this, the oldest
+# lines are silently dropped (newest win)
+LOG_BUFFER_LEN = 10000
+
+# Linux <netinet/in.h> values, the socket module doesn't export these
+IP_MTU_DISCOVER = getattr(socket, "IP_MTU_DISCOVER", 10)
+IP_PMTUDISC_DO = getattr(socket, "IP_PMTUDISC_DO", 2)
+
+
+# ctypes mirrors of the Linux structs sendmmsg() wants
+class _IOVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_IOVec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _MsgHdr), ("msg_len", ctypes.c_uint)]
+
+
+def _load_sendmmsg():
+    """Return libc's sendmmsg (or None if we're not on Linux / it's missing)."""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fn = libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    fn.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int]
+    fn.restype = ctypes.c_int
+    return fn
+
+
+_sendmmsg = _load_sendmmsg()
+
+
+def _exit_on_sigterm(signum, frame) -> None:
+    """SIGTERM (e.g. a harness timeout) -> SystemExit, so run()'s finally still flushes the log."""
+    raise SystemExit(128 + signum)
 
 
 class BaseSender(ABC):
@@ -25,6 +97,18 @@ class BaseSender(ABC):
     Lets algorithms focus on congestion control logic.
     """
     
+    # fixed attribute layout - faster lookups on the per-packet path, no per-instance __dict__
+    # (subclasses that don't declare __slots__ still get a __dict__ as usual)
+    __slots__ = (
+        "host", "port",
+        "rtt_tracker", "metrics",
+        "_debug", "_log_buf",
+        "sock", "_selector", "addr",
+        "payload_data", "_payload_mv", "_pkt_cache", "_builder", "total_bytes",
+        "_mmsg", "_iov",
+        "_recv_buf", "_recv_mv",
+    )
+    
     def __init__(self, host: Optional[str] = None, port: Optional[int] = None):
         """Initialize base sender. Defaults to env vars or localhost:5001."""
         self.host = host or os.environ.get("RECEIVER_HOST", "127.0.0.1")
@@ -33,10 +117,26 @@ class BaseSender(ABC):
         self.rtt_tracker = RTTTracker()
         self.metrics = TransferMetrics()
         
+        # hot-path logging is off unless CC_DEBUG=1; callers check _debug before formatting
+        self._debug = os.environ.get("CC_DEBUG") == "1"
+        self._log_buf: deque = deque(maxlen=LOG_BUFFER_LEN)
+        
         self.sock: Optional[socket.socket] = None
+        self._selector: Optional[selectors.BaseSelector] = None
         self.addr: Optional[Tuple[str, int]] = None
         self.payload_data: Optional[bytes] = None
+        self._payload_mv: Optional[memoryview] = None
+        self._pkt_cache: List[Optional[bytes]] = []  # built packets by index, dropped once ACKed
+        self._builder = PacketBuilder()  # scratch buffer for send_packet() and FIN/ACK
         self.total_bytes = 0
+        
+        # persistent sendmmsg() buffers, set up in connect()
+        self._mmsg = None
+        self._iov = None
+        
+        # reusable ACK receive buffer, so recv doesn't allocate a bytes per ACK
+        self._recv_buf = bytearray(PACKET_SIZE)
+        self._recv_mv = memoryview(self._recv_buf)
     
     def load_payload(self) -> bytes:
         """
@@ -58,6 +158,8 @@ class BaseSender(ABC):
                 with open(expanded, "rb") as f:
                     data = f.read()
                     self.total_bytes = len(data)
+                    self._payload_mv = memoryview(data)
+                    self._pkt_cache = [None] * ((self.total_bytes + MSS - 1) // MSS)
                     print(f"Loaded payload: {expanded} ({self.total_bytes:,} bytes)")
                     return data
         
@@ -65,75 +167,266 @@ class BaseSender(ABC):
             "Could not find payload file (tried TEST_FILE, PAYLOAD_FILE, /hdd/file.zip, file.zip)"
         )
     
+    def chunk(self, idx: int) -> memoryview:
+        """Zero-copy view of the idx-th MSS-sized slice of the payload."""
+        off = idx * MSS
+        return self._payload_mv[off:off + MSS]
+    
+    def _chunk_packet(self, idx: int) -> bytes:
+        """
+        Packet for payload chunk idx, cached so retransmits don't re-serialize.
+        
+        Keyed by chunk index only, so it's only used by the by-index senders
+        (_batch_send / send_chunk), where the payload is always chunk(idx).
+        """
+        pkt = self._pkt_cache[idx]
+        if pkt is None:
+            pkt = make_packet(idx * MSS, self.chunk(idx))
+            self._pkt_cache[idx] = pkt
+        return pkt
+    
+    def release_packet(self, idx: int) -> None:
+        """Drop the cached bytes for packet idx once it's been ACKed."""
+        self._pkt_cache[idx] = None
+    
     def connect(self) -> None:
-        """Create UDP socket and set initial timeout."""
+        """
+        Create a connected, non-blocking UDP socket and register it with a selector (epoll on Linux).
+        
+        Connecting lets the kernel cache the destination, so we can use
+        send()/recv() and skip the sockaddr copy on every packet.
+        """
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sock.settimeout(1.0)  # will be updated by RTO as we get samples
+        self.sock.connect((self.host, self.port))
+        
+        # big buffers so a full cwnd burst doesn't get dropped locally (and look like congestion)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCK_BUF_SIZE)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCK_BUF_SIZE)
+        if sys.platform.startswith("linux"):
+            # set DF, never let the kernel fragment our datagrams
+            self.sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO)
+        
+        # timeouts are handled by receive_ack's select() deadline, not SO_RCVTIMEO
+        self.sock.setblocking(False)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self.sock, selectors.EVENT_READ)
         self.addr = (self.host, self.port)
+        
+        if _sendmmsg is not None:
+            # build the msghdr array once, batches only fill in the iovecs
+            # (no msg_name needed - the socket is connected)
+            self._iov = (_IOVec * MAX_BATCH)()
+            self._mmsg = (_MMsgHdr * MAX_BATCH)()
+            for i in range(MAX_BATCH):
+                hdr = self._mmsg[i].msg_hdr
+                hdr.msg_iov = ctypes.pointer(self._iov[i])
+                hdr.msg_iovlen = 1
+        
         print(f"Connecting to receiver at {self.host}:{self.port}")
+        # kernel doubles the request and clamps to net.core.{w,r}mem_max, so show what we got
+        sndbuf = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)
+        rcvbuf = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        print(f"Socket buffers: sndbuf={sndbuf:,} rcvbuf={rcvbuf:,} bytes")
     
     def close(self) -> None:
         """Close socket."""
+        if self._selector:
+            self._selector.close()
+            self._selector = None
         if self.sock:
             self.sock.close()
             self.sock = None
     
-    def send_packet(self, seq_id: int, payload: bytes) -> float:
-        """Send a packet and return send timestamp."""
+    def send_packet(self, seq_id: int, payload: bytes) -> int:
+        """Send a packet and return send timestamp (time.monotonic_ns)."""
         if not self.sock:
             raise RuntimeError("Socket not connected - call connect() first")
         
-        pkt = make_packet(seq_id, payload)
-        send_time = time.time()
-        self.sock.sendto(pkt, self.addr)
+        pkt = self._builder.build(seq_id, payload)
+        send_time = time.monotonic_ns()
+        self._send(pkt)
         self.metrics.record_packet_sent(len(payload), send_time)
         return send_time
     
-    def receive_ack(self, timeout: Optional[float] = None) -> Tuple[int, str, float]:
-        """Wait for ACK and return (ack_id, message, recv_time)."""
+    def send_chunk(self, idx: int) -> int:
+        """Send payload chunk idx (e.g. a retransmit) from the packet cache, return send timestamp."""
         if not self.sock:
             raise RuntimeError("Socket not connected - call connect() first")
         
-        # use provided timeout or socket's current timeout
-        if timeout is not None:
-            old_timeout = self.sock.gettimeout()
-            self.sock.settimeout(timeout)
+        pkt = self._chunk_packet(idx)
+        send_time = time.monotonic_ns()
+        self._send(pkt)
+        self.metrics.record_packet_sent(len(pkt) - SEQ_ID_SIZE, send_time)
+        return send_time
+    
+    def _batch_send(self, idxs: Sequence[int]) -> int:
+        """
+        Send the payload chunks in idxs and return the shared send timestamp.
+        
+        One clock read covers the whole batch - everything in a sendmmsg()
+        call hits the kernel within microseconds of each other.
+        
+        Uses sendmmsg() on Linux so a whole window goes out in a few syscalls
+        instead of one send() per packet. Falls back to a send() loop elsewhere.
+        """
+        if not self.sock:
+            raise RuntimeError("Socket not connected - call connect() first")
+        
+        chunk_packet = self._chunk_packet
+        raw = [chunk_packet(idx) for idx in idxs]
+        send_time = time.monotonic_ns()
+        
+        sent = 0
+        if self._mmsg is not None:
+            fd = self.sock.fileno()
+            while sent < len(raw):
+                n = min(len(raw) - sent, MAX_BATCH)
+                for i in range(n):
+                    pkt = raw[sent + i]
+                    self._iov[i].iov_base = ctypes.cast(ctypes.c_char_p(pkt), ctypes.c_void_p)
+                    self._iov[i].iov_len = len(pkt)
+                ret = _sendmmsg(fd, self._mmsg, n, 0)
+                if ret <= 0:
+                    # send buffer full (socket is non-blocking) - let _send() wait it out
+                    break
+                sent += ret
         
+        for pkt in raw[sent:]:
+            self._send(pkt)
+        
+        nbytes = sum(len(pkt) for pkt in raw) - SEQ_ID_SIZE * len(raw)
+        self.metrics.record_batch_sent(nbytes, len(raw), send_time)
+        return send_time
+    
+    def _send(self, pkt: bytes | memoryview) -> None:
+        """send() that waits for room when the (non-blocking) send buffer is full."""
+        while True:
+            try:
+                self.sock.send(pkt)
+                return
+            except BlockingIOError:
+                select.select([], [self.sock], [])
+            except ConnectionRefusedError:
+                # stale ICMP port-unreachable reported on a connected socket - just resend
+                continue
+    
+    def receive_ack(self, timeout: Optional[float] = None) -> Tuple[int, Optional[bytes], int]:
+        """
+        Wait for ACK and return (ack_id, message, recv_time in monotonic_ns).
+        
+        message is raw bytes, or None for a plain ACK (see parse_ack).
+        
+        Waits up to timeout (default: current RTO) and raises socket.timeout
+        if nothing arrives by then.
+        """
+        n = self._recv_wait(timeout)
+        recv_time = time.monotonic_ns()
+        ack_id, msg = parse_ack(self._recv_mv[:n])
+        return ack_id, msg, recv_time
+    
+    def receive_ack_id(self, timeout: Optional[float] = None) -> Tuple[int, int]:
+        """
+        receive_ack() minus the message: (ack_id, recv_time in monotonic_ns).
+        
+        For loops that only ever get plain ACKs (e.g. before the EOF marker
+        goes out, since the receiver only sends "fin" after that).
+        """
+        n = self._recv_wait(timeout)
+        recv_time = time.monotonic_ns()
+        return parse_ack_id(self._recv_mv[:n]), recv_time
+    
+    def _recv_wait(self, timeout: Optional[float]) -> int:
+        """Block until one datagram is in _recv_buf and return its length (socket.timeout on expiry)."""
+        if not self.sock:
+            raise RuntimeError("Socket not connected - call connect() first")
+        
+        if timeout is None:
+            timeout = self.rtt_tracker.get_rto()
+        deadline = time.monotonic() + timeout
+        
+        while True:
+            if not self._selector.select(max(deadline - time.monotonic(), 0.0)):
+                raise socket.timeout("timed out")
+            try:
+                return self.sock.recv_into(self._recv_buf, PACKET_SIZE)
+            except (BlockingIOError, ConnectionRefusedError):
+                # spurious wakeup, or ICMP port-unreachable before the receiver was up
+                continue
+    
+    def poll_ack_id(self) -> Optional[Tuple[int, int]]:
+        """
+        Non-blocking receive: the next queued (ack_id, recv_time in monotonic_ns), or None if nothing's waiting.
+        
+        Lets a sender drain every ACK that piled up during one wake-up
+        without going back through the selector for each. Each ACK gets its
+        own timestamp, since a retransmit while draining can stamp a send time
+        later than the first ACK's.
+        """
         try:
-            ack_pkt, _ = self.sock.recvfrom(PACKET_SIZE)
-            recv_time = time.time()
-            ack_id, msg = parse_ack(ack_pkt)
-            return ack_id, msg, recv_time
-        finally:
-            if timeout is not None:
-                self.sock.settimeout(old_timeout)
+            n = self.sock.recv_into(self._recv_buf, PACKET_SIZE)
+        except (BlockingIOError, ConnectionRefusedError):
+            return None
+        return parse_ack_id(self._recv_mv[:n]), time.monotonic_ns()
     
-    def update_rtt(self, send_time: float, ack_time: float, is_retransmission: bool = False) -> None:
-        """Update RTT tracker and metrics, then update socket timeout to new RTO."""
-        sample_rtt = ack_time - send_time
-        self.rtt_tracker.update(sample_rtt, is_retransmission)
+    def _on_ack(self, send_time: int, ack_time: int, is_retrans: bool) -> float:
+        """
+        Per-ACK bookkeeping in one call: RTT estimate + delay metric.
+        
+        Takes monotonic_ns timestamps and returns the RTT sample in seconds so
+        subclasses can feed their own signals without recomputing it.
+        The new RTO is picked up by the next receive_ack().
+        """
+        sample_rtt = (ack_time - send_time) * 1e-9
+        self.rtt_tracker.update(sample_rtt, is_retrans)
         self.metrics.record_packet_acked(send_time, ack_time)
+        return sample_rtt
+    
+    def _on_ack_batch(self, send_times: Sequence[int], ack_time: int, retrans: Sequence[int]) -> List[float]:
+        """
+        _on_ack() for a run of packets freed by one cumulative ACK.
         
-        if self.sock:
-            rto = self.rtt_tracker.get_rto()
-            self.sock.settimeout(rto)
+        send_times and retrans are parallel sequences (retrans = retry counts, nonzero
+        means retransmitted). Feeds the RTT tracker and delay metric in
+        one call each and returns the non-retransmitted RTT samples in seconds.
+        """
+        samples = [(ack_time - t) * 1e-9 for t, r in zip(send_times, retrans) if not r]
+        self.rtt_tracker.update_batch(samples)
+        self.metrics.record_batch_acked(sum(send_times), len(send_times), ack_time)
+        return samples
+    
+    def update_rtt(self, send_time: int, ack_time: int, is_retransmission: bool = False) -> None:
+        """Update RTT tracker and metrics for one ACKed packet."""
+        self._on_ack(send_time, ack_time, is_retransmission)
     
     def handle_fin(self, ack_id: int) -> None:
         """Send FIN/ACK in response to receiver's FIN."""
         if not self.sock:
             return
         
-        fin_ack = make_packet(ack_id, b"FIN/ACK")
-        self.sock.sendto(fin_ack, self.addr)
+        self._send(self._builder.build(ack_id, b"FIN/ACK"))
         print("Sent FIN/ACK to receiver")
     
+    def _log(self, msg: str) -> None:
+        """
+        Buffer a debug line - nothing touches stdout until _flush_log().
+        
+        Only the last LOG_BUFFER_LEN lines are kept; older ones are dropped without notice.
+        """
+        self._log_buf.append(msg)
+    
+    def _flush_log(self) -> None:
+        """Print and clear buffered debug lines."""
+        while self._log_buf:
+            print(self._log_buf.popleft())
+    
     def print_metrics(self) -> None:
         """Print metrics in format expected by test scripts."""
+        self._flush_log()
+        
         duration = self.metrics.get_duration()
         throughput = self.metrics.get_throughput()
         avg_delay = self.metrics.get_avg_delay()
         avg_jitter = self.metrics.get_avg_jitter()
-        score = self.metrics.get_score()
         
         print("\nTransfer complete!")
         print(f"duration={duration:.3f}s throughput={throughput:.2f} bytes/sec")
@@ -152,6 +445,12 @@ class BaseSender(ABC):
     
     def run(self) -> None:
         """Main entry point - runs the full transfer."""
+        # only for the duration of the transfer - the caller's handler comes back after
+        try:
+            prev_sigterm = signal.signal(signal.SIGTERM, _exit_on_sigterm)
+        except ValueError:
+            prev_sigterm = None  # not the main thread, leave signal handling alone
+        
         try:
             self.payload_data = self.load_payload()
             self.connect()
@@ -166,7 +465,11 @@ class BaseSender(ABC):
             print(f"Sender error: {exc}", file=sys.stderr)
             raise
         finally:
+            # also on Ctrl-C / a harness kill - those hung runs are when the log matters most
+            self._flush_log()
             self.close()
+            if prev_sigterm is not None:
+                signal.signal(signal.SIGTERM, prev_sigterm)
 
 
 # minimal test to verify base class works
@@ -181,7 +484,7 @@ if __name__ == "__main__":
             
             try:
                 ack_id, msg, ack_time = self.receive_ack()
-                print(f"Received {msg} for ack_id={ack_id}")
+                print(f"Received {msg.decode(errors='ignore') if msg else 'ack'} for ack_id={ack_id}")
                 self.update_rtt(send_time, ack_time)
                 
                 # send EOF
@@ -189,7 +492,7 @@ if __name__ == "__main__":
                 self.send_packet(eof_seq, b"")
                 
                 ack_id, msg, _ = self.receive_ack()
-                if msg.startswith("fin"):
+                if msg is not None and msg[:3] == FIN_PREFIX:
                     self.handle_fin(ack_id)
             except socket.timeout:
                 print("Timeout waiting for ACK", file=sys.stderr)
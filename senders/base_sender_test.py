@@ -23,7 +23,7 @@ if repo_root not in sys.path:
     sys.path.insert(0, repo_root)
 
 from senders.base_sender import BaseSender
-from senders.packet_utils import MSS
+from senders.packet_utils import FIN_PREFIX, MSS
 
 
 class BaseFrameworkTest(BaseSender):
@@ -38,7 +38,7 @@ class BaseFrameworkTest(BaseSender):
         try:
             # Wait for ACK
             ack_id, msg, ack_time = self.receive_ack()
-            print(f"Received {msg} for ack_id={ack_id}")
+            print(f"Received {msg.decode(errors='ignore') if msg else 'ack'} for ack_id={ack_id}")
             self.update_rtt(send_time, ack_time)
 
             # Send EOF (empty payload at end-of-file seq number)
@@ -47,7 +47,7 @@ class BaseFrameworkTest(BaseSender):
 
             # Wait for FIN from receiver and respond
             ack_id, msg, _ = self.receive_ack()
-            if msg.startswith("fin"):
+            if msg is not None and msg[:3] == FIN_PREFIX:
                 print("Received FIN, sending FIN/ACK")
                 self.handle_fin(ack_id)
 
@@ -11,11 +11,23 @@ from __future__ import annotations
 import socket
 import sys
 import time
-from collections import deque
-from typing import Dict, Optional, Tuple
+from array import array
+from typing import List, Optional, Sequence
 
 from senders.base_sender import BaseSender
-from senders.packet_utils import MSS, make_packet
+from senders.metrics import RingStats
+from senders.packet_utils import FIN_PREFIX, MSS
+
+# ring buffer sizes for the delay / phase-detection signals
+RTT_HISTORY_LEN = 10
+TPUT_HISTORY_LEN = 5
+
+# what the ACK handlers ask send_packets() to do next
+ACTION_NONE = 0
+ACTION_FAST_RETRANSMIT = 1
+ACTION_EXIT_FR = 2
+ACTION_FILL_HOLE = 3
+ACTION_RETRANSMIT_EXPIRED = 4
 
 
 class CustomProtocol(BaseSender):
@@ -26,16 +38,35 @@ class CustomProtocol(BaseSender):
     and phase detection to adapt better than standard TCP.
     """
     
+    __slots__ = (
+        # congestion control state
+        "cwnd", "_cwnd_int", "ssthresh", "in_slow_start", "in_fast_recovery", "in_rto_recovery",
+        "recovery_point",
+        # BDP estimation
+        "estimated_bdp", "bdp_multiplier",
+        # delay signals / phase detection
+        "base_rtt", "current_rtt", "rtt_history", "rtt_gradient",
+        "throughput_history", "last_phase_change",
+        # packet tracking
+        "send_times", "retrans_counts", "oldest_unacked",
+        "next_seq", "_highest_sent_seq", "_loss_epoch_end",
+        "highest_acked", "dup_ack_count", "last_ack_id",
+        # tuning parameters
+        "rtt_gradient_threshold", "ca_increment", "delay_reduction_factor", "initial_window",
+    )
+    
     def __init__(self, host: Optional[str] = None, port: Optional[int] = None):
         """Initialize with tuned parameters."""
         super().__init__(host, port)
         
         # congestion control state
         self.cwnd = 10.0  # start with 10 packets (faster than Reno's 1)
+        self._cwnd_int = int(self.cwnd)  # refreshed wherever cwnd changes so the send gate skips the float->int
         self.ssthresh = 32.0
         self.in_slow_start = True
         self.in_fast_recovery = False
-        self.recovery_point = 0  # highest seq before fast retransmit
+        self.in_rto_recovery = False  # after a timeout, until everything sent before it is ACKed
+        self.recovery_point = 0  # highest seq sent when we entered fast/RTO recovery
         
         # BDP estimation
         self.estimated_bdp = 32.0  # initial guess
@@ -44,16 +75,21 @@ class CustomProtocol(BaseSender):
         # RTT tracking for delay signals
         self.base_rtt: Optional[float] = None  # minimum RTT (propagation only)
         self.current_rtt: Optional[float] = None
-        self.rtt_history: deque = deque(maxlen=10)
+        # last 10 samples, newest 3 count as "recent" - running sums keep per-ACK stats O(1)
+        self.rtt_history = RingStats(RTT_HISTORY_LEN, recent=3)
         self.rtt_gradient = 0.0  # how much RTT increased above base
         
-        # phase detection
-        self.throughput_history: deque = deque(maxlen=5)
-        self.last_phase_change = time.time()
+        # phase detection - last 5 throughput readings, newest 2 count as "recent"
+        self.throughput_history = RingStats(TPUT_HISTORY_LEN, recent=2)
+        self.last_phase_change = time.monotonic_ns()
         
-        # packet tracking
-        self.in_flight: Dict[int, Tuple[float, bytes, int]] = {}  # seq -> (send_time, payload, retrans_count)
+        # packet tracking - parallel arrays indexed by packet number, sized in send_packets()
+        self.send_times = array("q")  # last send time per packet (monotonic_ns)
+        self.retrans_counts = array("B")  # retransmissions per packet (capped at 255)
+        self.oldest_unacked = 0  # everything below this index is ACKed (ACKs are cumulative)
         self.next_seq = 0
+        self._highest_sent_seq = 0  # seq of the last packet sent, kept in step with next_seq
+        self._loss_epoch_end = -1  # highest seq sent at the last cwnd cut
         self.highest_acked = -1
         self.dup_ack_count = 0
         self.last_ack_id = -1
@@ -76,7 +112,7 @@ class CustomProtocol(BaseSender):
         
         # estimate bandwidth from recent throughput
         if len(self.throughput_history) > 0:
-            avg_throughput = sum(self.throughput_history) / len(self.throughput_history)
+            avg_throughput = self.throughput_history.mean()
             # throughput is in bytes/sec, convert to packets/sec
             packets_per_sec = avg_throughput / MSS
             # BDP = packets_in_flight = rate * RTT
@@ -86,18 +122,26 @@ class CustomProtocol(BaseSender):
         
         return max(self.estimated_bdp * self.bdp_multiplier, 10.0)
     
+    def _on_ack_batch(self, send_times: Sequence[int], ack_time: int, retrans: Sequence[int]) -> List[float]:
+        """Base RTT/metrics update, then our delay signals for each non-retransmitted sample (Karn's algorithm)."""
+        samples = super()._on_ack_batch(send_times, ack_time, retrans)
+        update_rtt_signals = self.update_rtt_signals
+        for sample_rtt in samples:
+            update_rtt_signals(sample_rtt)
+        return samples
+    
     def update_rtt_signals(self, sample_rtt: float) -> None:
         """Update RTT tracking for delay-based signals."""
         self.current_rtt = sample_rtt
-        self.rtt_history.append(sample_rtt)
+        self.rtt_history.push(sample_rtt)
         
-        # track base RTT (minimum = propagation delay, no queue)
+        # track base RTT (running min = propagation delay, no queue)
         if self.base_rtt is None or sample_rtt < self.base_rtt:
             self.base_rtt = sample_rtt
         
         # calculate RTT gradient (how much above base = queue buildup)
         if len(self.rtt_history) >= 2 and self.base_rtt is not None:
-            recent_avg = sum(list(self.rtt_history)[-3:]) / min(3, len(self.rtt_history))
+            recent_avg = self.rtt_history.recent_mean()
             if self.base_rtt > 0:
                 self.rtt_gradient = recent_avg / self.base_rtt  # 1.0 = no queue, >1.0 = queue building
     
@@ -108,20 +152,31 @@ class CustomProtocol(BaseSender):
         When network switches phases, RTT or throughput changes suddenly.
         We detect this to reset our estimates and adapt faster.
         """
-        if len(self.rtt_history) < 3 or len(self.throughput_history) < 3:
+        rtts = self.rtt_history
+        tputs = self.throughput_history
+        # need a full "recent" RTT window, and at least one throughput reading older than it
+        if len(rtts) < rtts.recent or len(tputs) <= tputs.recent:
             return False
         
         # check for sudden RTT change (>30% = probably phase transition)
-        recent_rtt = sum(list(self.rtt_history)[-3:]) / 3
-        older_rtt = sum(list(self.rtt_history)[:-3]) / max(1, len(self.rtt_history) - 3)
-        if older_rtt > 0 and abs(recent_rtt - older_rtt) / older_rtt > 0.3:
-            return True
-        
-        # check for sudden throughput change (>40%)
-        if len(self.throughput_history) >= 3:
-            recent_tput = sum(list(self.throughput_history)[-2:]) / 2
-            older_tput = self.throughput_history[0] if len(self.throughput_history) > 2 else recent_tput
-            if older_tput > 0 and abs(recent_tput - older_tput) / older_tput > 0.4:
+        recent_rtt = rtts.recent_mean()
+        older_rtt = rtts.older_mean()
+        if older_rtt > 0:
+            # inline sign flip instead of abs() - this runs on every ACK
+            diff = recent_rtt - older_rtt
+            if diff < 0:
+                diff = -diff
+            if diff / older_rtt > 0.3:
+                return True
+        
+        # check for sudden throughput change (>40%): newest readings vs oldest
+        recent_tput = tputs.recent_mean()
+        older_tput = tputs.oldest()
+        if older_tput > 0:
+            diff = recent_tput - older_tput
+            if diff < 0:
+                diff = -diff
+            if diff / older_tput > 0.4:
                 return True
         
         return False
@@ -131,7 +186,7 @@ class CustomProtocol(BaseSender):
         # update throughput estimate for BDP calculation
         if self.metrics.get_duration() > 0:
             tput = self.metrics.get_throughput()
-            self.throughput_history.append(tput)
+            self.throughput_history.push(tput)
         
         # check for phase transition
         if self.detect_phase_transition():
@@ -166,142 +221,246 @@ class CustomProtocol(BaseSender):
             # RTT is increasing, reduce window slightly to avoid congestion
             self.cwnd *= self.delay_reduction_factor
             self.cwnd = max(self.cwnd, 1.0)
+        
+        self._cwnd_int = int(self.cwnd)
     
     def handle_loss(self, is_timeout: bool) -> None:
-        """Handle packet loss (timeout or 3 dup ACKs)."""
+        """
+        Handle packet loss (timeout or 3 dup ACKs).
+        
+        Cuts cwnd at most once per window of data: a hole in packets sent
+        before the last cut belongs to that same loss event, so it doesn't
+        halve the window again.
+        """
+        new_event = self.oldest_unacked * MSS > self._loss_epoch_end
+        if new_event:
+            self._loss_epoch_end = self._highest_sent_seq
+        
         if is_timeout:
             # timeout: less aggressive than resetting to 1
             # use ssthresh instead of going all the way back to initial_window
-            self.ssthresh = max(self.cwnd / 2.0, 2.0)
+            if new_event:
+                self.ssthresh = max(self.cwnd / 2.0, 2.0)
+            # always deflate, even within the same epoch - cwnd may still carry the
+            # dup-ACK inflation from fast recovery, which must not become the CA window
             self.cwnd = max(self.ssthresh, float(self.initial_window))  # don't go below ssthresh
             self.in_slow_start = False  # stay in CA, don't go back to slow start
             self.in_fast_recovery = False
+            self.in_rto_recovery = True
+            self.recovery_point = self._highest_sent_seq
         else:
             # 3 dup ACKs: fast retransmit
-            self.ssthresh = max(self.cwnd / 2.0, 2.0)
+            if new_event:
+                self.ssthresh = max(self.cwnd / 2.0, 2.0)
             self.cwnd = self.ssthresh + 3.0  # inflate for dup ACKs
             self.in_fast_recovery = True
-            self.recovery_point = max(seq for seq in self.in_flight.keys()) if self.in_flight else self.next_seq
+            self.in_rto_recovery = False
+            self.recovery_point = self._highest_sent_seq
+        
+        self._cwnd_int = int(self.cwnd)
+    
+    def on_dup_ack(self) -> int:
+        """Count a duplicate ACK. Returns ACTION_FAST_RETRANSMIT on the third one."""
+        self.dup_ack_count += 1
+        if self.dup_ack_count == 3 and not self.in_fast_recovery:
+            self.handle_loss(is_timeout=False)
+            return ACTION_FAST_RETRANSMIT
+        if self.in_fast_recovery:
+            # inflate window in fast recovery
+            self.cwnd += 1.0
+            self._cwnd_int = int(self.cwnd)
+        return ACTION_NONE
+    
+    def on_new_ack(self, ack_id: int, ack_time: int) -> int:
+        """
+        Apply a new cumulative ACK: slide the window, take RTT samples, grow cwnd.
+        
+        Returns ACTION_EXIT_FR if this ACK ended fast recovery, ACTION_FILL_HOLE
+        if it was a partial ACK during fast recovery, ACTION_RETRANSMIT_EXPIRED if
+        it was a partial ACK after a timeout, else ACTION_NONE.
+        """
+        self.dup_ack_count = 0
+        self.last_ack_id = ack_id
+        
+        if ack_id <= self.highest_acked:
+            # stale/reordered cumulative ACK - everything it covers was already freed
+            return ACTION_NONE
+        self.highest_acked = ack_id
+        
+        # receiver uses cumulative ACKs, so the ACKed packets are always a contiguous prefix
+        sent = self.next_seq // MSS
+        new_base = sent if ack_id >= self.total_bytes else min(ack_id // MSS, sent)
+        
+        # walk just the newly ACKed range
+        lo = self.oldest_unacked
+        if new_base > lo:
+            for i in range(lo, new_base):
+                self.release_packet(i)
+            # RTT, metrics and delay signals for the whole run at once (Karn's algorithm skips retransmits)
+            self._on_ack_batch(self.send_times[lo:new_base], ack_time, self.retrans_counts[lo:new_base])
+            self.oldest_unacked = new_base
+        
+        self.update_window_on_ack(ack_id)
+        
+        if self.in_fast_recovery:
+            # exit fast recovery if we got ACK above recovery point
+            if ack_id >= self.recovery_point:
+                self.cwnd = self.ssthresh
+                self._cwnd_int = int(self.cwnd)
+                self.in_fast_recovery = False
+                return ACTION_EXIT_FR
+            # partial ACK: the receiver only ACKs cumulatively, so the next hole
+            # from the same loss event starts right at the new ACK point
+            return ACTION_FILL_HOLE
+        
+        if self.in_rto_recovery:
+            if ack_id >= self.recovery_point:
+                self.in_rto_recovery = False
+            else:
+                # still digging out after a timeout - let this ACK clock out more retransmits
+                return ACTION_RETRANSMIT_EXPIRED
+        return ACTION_NONE
+    
+    def process_ack(self, ack_id: int, ack_time: int) -> None:
+        """Classify one ACK and do whatever retransmit it calls for."""
+        base = self.oldest_unacked
+        if ack_id == self.last_ack_id:
+            if base * MSS >= self.next_seq:
+                # dup of an ACK that already covered everything sent - nothing to
+                # retransmit, and no reason to cut cwnd
+                return
+            action = self.on_dup_ack()
+        else:
+            action = self.on_new_ack(ack_id, ack_time)
+        
+        if action in (ACTION_FAST_RETRANSMIT, ACTION_FILL_HOLE) and self.oldest_unacked * MSS >= self.next_seq:
+            # nothing left in flight, so there's no hole to fill
+            return
+        
+        if action == ACTION_FAST_RETRANSMIT:
+            self.retransmit(self.oldest_unacked)
+            if self._debug:
+                self._log(f"Fast retransmit: seq={self.oldest_unacked * MSS}, cwnd={self.cwnd:.1f}")
+        elif action == ACTION_FILL_HOLE:
+            # retransmit the next hole now instead of waiting for dup ACKs or an RTO
+            self.retransmit(self.oldest_unacked)
+            if self._debug:
+                self._log(f"Partial ACK: retransmit seq={self.oldest_unacked * MSS}")
+        elif action == ACTION_RETRANSMIT_EXPIRED:
+            # one retransmit per packet this ACK freed, so recovery stays ACK-clocked
+            count = self.retransmit_expired(self.oldest_unacked - base)
+            if self._debug and count:
+                self._log(f"Partial ACK after timeout: retransmit {count} expired from seq={self.oldest_unacked * MSS}")
+        elif action == ACTION_EXIT_FR and self._debug:
+            self._log(f"Exited fast recovery: cwnd={self.cwnd:.1f}")
+    
+    def retransmit(self, idx: int) -> int:
+        """Resend packet idx, restart its timer and return its retry count."""
+        self.send_times[idx] = self.send_chunk(idx)
+        retries = min(self.retrans_counts[idx] + 1, 255)
+        self.retrans_counts[idx] = retries
+        return retries
+    
+    def retransmit_expired(self, limit: int) -> int:
+        """
+        Resend up to `limit` unACKed packets whose timer has run out (oldest first).
+        
+        Without SACK we can't tell which of them were really lost, so after a
+        burst loss this refills the holes a window at a time instead of one per RTO.
+        Returns how many went out.
+        """
+        if limit <= 0:
+            return 0
+        
+        send_times = self.send_times
+        expired = time.monotonic_ns() - int(self.rtt_tracker.get_rto() * 1e9)
+        idxs = []
+        for i in range(self.oldest_unacked, self.next_seq // MSS):
+            if send_times[i] <= expired:
+                idxs.append(i)
+                if len(idxs) == limit:
+                    break
+        if not idxs:
+            return 0
+        
+        send_time = self._batch_send(idxs)
+        retrans_counts = self.retrans_counts
+        for i in idxs:
+            send_times[i] = send_time
+            retrans_counts[i] = min(retrans_counts[i] + 1, 255)
+        return len(idxs)
     
     def send_packets(self) -> None:
         """Main packet sending loop."""
         if not self.payload_data:
             return
         
-        # chunk payload into MSS-sized packets
-        chunks = []
-        for i in range(0, len(self.payload_data), MSS):
-            chunks.append(self.payload_data[i:i + MSS])
-        
-        total_packets = len(chunks)
+        # chunks are sliced lazily as views via self.chunk(), no upfront copy
+        total_packets = (len(self.payload_data) + MSS - 1) // MSS
         packets_sent = 0
-        packets_acked = 0
+        
+        # per-packet state, indexed by packet number (seq // MSS)
+        self.send_times = array("q", bytes(8 * total_packets))
+        self.retrans_counts = array("B", bytes(total_packets))
+        self.oldest_unacked = 0
         
         print(f"Starting transfer: {len(self.payload_data):,} bytes, {total_packets} packets")
         print(f"Initial cwnd={self.cwnd:.1f}, ssthresh={self.ssthresh:.1f}")
         
-        while packets_acked < total_packets:
-            # send packets up to window size
-            while len(self.in_flight) < int(self.cwnd) and packets_sent < total_packets:
-                seq_id = packets_sent * MSS
-                payload = chunks[packets_sent]
-                
-                send_time = self.send_packet(seq_id, payload)
-                self.in_flight[seq_id] = (send_time, payload, 0)
-                packets_sent += 1
+        # bind hot attributes/methods once - local loads are much cheaper than self.X
+        batch_send = self._batch_send
+        # ID-only receives: the receiver only says "fin" after the EOF marker, which goes out after this loop
+        receive_ack_id = self.receive_ack_id
+        poll_ack_id = self.poll_ack_id
+        send_times = self.send_times
+        
+        while self.oldest_unacked < total_packets:
+            # send packets up to window size - one batched flush instead of a send() each
+            in_flight = packets_sent - self.oldest_unacked
+            window = min(self._cwnd_int - in_flight, total_packets - packets_sent)
+            if window > 0:
+                first = packets_sent
+                packets_sent += window
+                send_time = batch_send(range(first, packets_sent))
+                for i in range(first, packets_sent):
+                    send_times[i] = send_time
+                self.next_seq = packets_sent * MSS
+                self._highest_sent_seq = self.next_seq - MSS
             
-            if not self.in_flight:
+            if packets_sent == self.oldest_unacked:
                 break
             
-            # wait for ACK
+            # wait for ACK - the ACK handlers do the bookkeeping, we only do IO here
             try:
-                ack_id, msg, ack_time = self.receive_ack()
-                
-                if msg.startswith("fin"):
-                    self.handle_fin(ack_id)
-                    break
-                
-                # check for duplicate ACK
-                if ack_id == self.last_ack_id:
-                    self.dup_ack_count += 1
-                    if self.dup_ack_count == 3 and not self.in_fast_recovery:
-                        # fast retransmit
-                        oldest_seq = min(self.in_flight.keys())
-                        if oldest_seq in self.in_flight:
-                            send_time, payload, retrans_count = self.in_flight[oldest_seq]
-                            self.send_packet(oldest_seq, payload)
-                            self.in_flight[oldest_seq] = (time.time(), payload, retrans_count + 1)
-                            self.handle_loss(is_timeout=False)
-                            print(f"Fast retransmit: seq={oldest_seq}, cwnd={self.cwnd:.1f}")
-                    elif self.in_fast_recovery:
-                        # inflate window in fast recovery
-                        self.cwnd += 1.0
-                else:
-                    # new ACK
-                    self.dup_ack_count = 0
-                    self.last_ack_id = ack_id
-                    
-                    # check if this ACK covers any packets we think are in flight
-                    # (receiver uses cumulative ACKs, so ack_id covers all packets up to that point)
-                    if ack_id > self.highest_acked:
-                        self.highest_acked = ack_id
-                        
-                        # remove ACKed packets from in-flight (cumulative ACK covers all previous packets)
-                        to_remove = [seq for seq in self.in_flight.keys() if seq + len(self.in_flight[seq][1]) <= ack_id]
-                        for seq in to_remove:
-                            send_time, _, retrans_count = self.in_flight.pop(seq)
-                            
-                            # update RTT (skip if retransmitted - Karn's algorithm)
-                            is_retrans = retrans_count > 0
-                            sample_rtt = ack_time - send_time
-                            self.update_rtt(send_time, ack_time, is_retransmission=is_retrans)
-                            if not is_retrans:
-                                self.update_rtt_signals(sample_rtt)
-                            
-                            packets_acked += 1
-                        
-                        # update window
-                        self.update_window_on_ack(ack_id)
-                        
-                        # exit fast recovery if we got ACK above recovery point
-                        if self.in_fast_recovery and ack_id >= self.recovery_point:
-                            self.cwnd = self.ssthresh
-                            self.in_fast_recovery = False
-                            print(f"Exited fast recovery: cwnd={self.cwnd:.1f}")
-                    else:
-                        # ACK is <= highest_acked, but might still cover packets we think are in flight
-                        # (could be a delayed ACK or we missed updating highest_acked)
-                        to_remove = [seq for seq in self.in_flight.keys() if seq + len(self.in_flight[seq][1]) <= ack_id]
-                        for seq in to_remove:
-                            if seq in self.in_flight:
-                                send_time, _, retrans_count = self.in_flight.pop(seq)
-                                packets_acked += 1
-            
+                ack_id, ack_time = receive_ack_id()
             except socket.timeout:
-                # timeout: retransmit oldest unACKed packet
-                if self.in_flight:
-                    oldest_seq = min(self.in_flight.keys())
-                    send_time, payload, retrans_count = self.in_flight[oldest_seq]
-                    
-                    # check if we've retransmitted this too many times
-                    if retrans_count >= 5:
-                        # might be stuck - check if receiver already ACKed it
-                        # (receiver uses cumulative ACKs, so if highest_acked > oldest_seq, it's already ACKed)
-                        if self.highest_acked >= oldest_seq + len(payload):
-                            # receiver already ACKed this, remove it
-                            self.in_flight.pop(oldest_seq)
-                            print(f"Removed seq={oldest_seq} - already ACKed (highest_acked={self.highest_acked})")
-                            continue
-                    
-                    self.send_packet(oldest_seq, payload)
-                    self.in_flight[oldest_seq] = (time.time(), payload, retrans_count + 1)
+                # timeout: cut the window, then resend the oldest unACKed packet and
+                # whatever else has expired, up to the new window
+                if packets_sent > self.oldest_unacked:
                     self.handle_loss(is_timeout=True)
-                    print(f"Timeout: retransmit seq={oldest_seq} (retry {retrans_count + 1}), cwnd={self.cwnd:.1f}")
+                    retries = self.retransmit(self.oldest_unacked)
+                    extra = self.retransmit_expired(self._cwnd_int - 1)
+                    if self._debug:
+                        self._log(f"Timeout: retransmit seq={self.oldest_unacked * MSS} (retry {retries}) "
+                                  f"+ {extra} expired, cwnd={self.cwnd:.1f}")
                 else:
                     # no packets in flight - might be done or stuck
-                    if packets_acked >= total_packets:
+                    if self.oldest_unacked >= total_packets:
                         break
-                    print("Timeout with no packets in flight - waiting for final ACKs", file=sys.stderr)
+                    if self._debug:
+                        self._log("Timeout with no packets in flight - waiting for final ACKs")
+                continue
+            
+            # handle this ACK and everything else already queued, then refill the window once
+            # (stop once everything's ACKed - leftover dups must not "retransmit" past the end)
+            while True:
+                self.process_ack(ack_id, ack_time)
+                if self.oldest_unacked >= total_packets:
+                    break
+                queued = poll_ack_id()
+                if queued is None:
+                    break
+                ack_id, ack_time = queued
         
         # send EOF marker
         eof_seq = total_packets * MSS
@@ -311,7 +470,7 @@ class CustomProtocol(BaseSender):
         # wait for FIN
         try:
             ack_id, msg, _ = self.receive_ack(timeout=5.0)
-            if msg.startswith("fin"):
+            if msg is not None and msg[:3] == FIN_PREFIX:
                 self.handle_fin(ack_id)
         except socket.timeout:
             print("Timeout waiting for FIN", file=sys.stderr)
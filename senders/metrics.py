@@ -6,7 +6,11 @@ Metrics tracking - RTT estimation and transfer stats.
 from __future__ import annotations
 
 import time
-from typing import List, Optional
+from array import array
+from typing import Iterable, Optional
+
+# throughput,avg_delay,avg_jitter,score - format parsed once, not per call
+_CSV_FMT = "{:.7f},{:.7f},{:.7f},{:.7f}".format
 
 
 class RTTTracker:
@@ -14,17 +18,32 @@ class RTTTracker:
     Tracks RTT samples and calculates timeouts (RFC 6298).
     
     Uses exponential weighted moving average for smoothed RTT and variance.
+    EWMA only needs the previous state, so samples aren't kept around.
     """
     
+    __slots__ = (
+        "alpha", "beta", "min_rto", "_granularity",
+        "_one_minus_alpha", "_one_minus_beta", "_beta_low", "_one_minus_beta_low",
+        "srtt", "rttvar", "_rto",
+    )
+    
     def __init__(self, alpha: float = 0.125, beta: float = 0.25, min_rto: float = 0.2):
         """Initialize RTT tracker. Defaults from RFC 6298."""
         self.alpha = alpha
         self.beta = beta
         self.min_rto = min_rto
+        self._granularity = 1e-3  # clock granularity G (RFC 6298), 1 ms
+        # hoisted so update() doesn't recompute them per sample
+        self._one_minus_alpha = 1.0 - alpha
+        self._one_minus_beta = 1.0 - beta
+        # damped variance gain for samples well below SRTT (1/32 with the default beta)
+        self._beta_low = beta / 8.0
+        self._one_minus_beta_low = 1.0 - self._beta_low
         
         self.srtt: Optional[float] = None  # smoothed RTT
         self.rttvar: Optional[float] = None  # RTT variance
-        self.rtt_samples: List[float] = []
+        # RTO is recomputed when a sample comes in, not on every read (1.0 until the first sample)
+        self._rto = 1.0
     
     def update(self, sample_rtt: float, is_retransmission: bool = False) -> None:
         """
@@ -40,24 +59,74 @@ class RTTTracker:
         if is_retransmission:
             return
         
-        self.rtt_samples.append(sample_rtt)
-        
         # initialize on first sample
         if self.srtt is None:
             self.srtt = sample_rtt
             self.rttvar = sample_rtt / 2.0
         else:
             # update using EWMA: SRTT = (1-α) * SRTT + α * sample
-            self.rttvar = (1 - self.beta) * self.rttvar + self.beta * abs(self.srtt - sample_rtt)
-            self.srtt = (1 - self.alpha) * self.srtt + self.alpha * sample_rtt
+            # RFC 6298 order matters: RTTVAR uses the *old* SRTT, so grab it once up front
+            srtt = self.srtt
+            rttvar = self.rttvar
+            err = srtt - sample_rtt
+            if err < 0:
+                err = -err
+            
+            if sample_rtt < srtt - rttvar:
+                # RTT dropped sharply - like Linux's tcp_rtt_estimator, let that barely
+                # move RTTVAR, otherwise the RTO balloons right when the path got better
+                self.rttvar = self._one_minus_beta_low * rttvar + self._beta_low * err
+            else:
+                self.rttvar = self._one_minus_beta * rttvar + self.beta * err
+            self.srtt = self._one_minus_alpha * srtt + self.alpha * sample_rtt
+        
+        self._refresh_rto()
     
-    def get_rto(self) -> float:
-        """Get retransmission timeout: RTO = SRTT + 4 * RTTVAR."""
-        if self.srtt is None or self.rttvar is None:
-            return 1.0  # no samples yet, use conservative default
+    def update_batch(self, samples: Iterable[float]) -> None:
+        """
+        Same as calling update() on each sample in order, in one call.
         
-        rto = self.srtt + 4.0 * self.rttvar
-        return max(rto, self.min_rto)
+        For a cumulative ACK that frees a bunch of packets at once - the recursion
+        runs on locals instead of reloading attributes per sample. Samples must
+        already have retransmissions filtered out (Karn's algorithm).
+        Keep the math in step with update().
+        """
+        it = iter(samples)
+        if self.srtt is None:
+            first = next(it, None)
+            if first is None:
+                return
+            self.update(first)
+        
+        srtt = self.srtt
+        rttvar = self.rttvar
+        alpha = self.alpha
+        one_minus_alpha = self._one_minus_alpha
+        beta = self.beta
+        one_minus_beta = self._one_minus_beta
+        beta_low = self._beta_low
+        one_minus_beta_low = self._one_minus_beta_low
+        for sample_rtt in it:
+            err = srtt - sample_rtt
+            if err < 0:
+                err = -err
+            if sample_rtt < srtt - rttvar:
+                rttvar = one_minus_beta_low * rttvar + beta_low * err
+            else:
+                rttvar = one_minus_beta * rttvar + beta * err
+            srtt = one_minus_alpha * srtt + alpha * sample_rtt
+        self.srtt = srtt
+        self.rttvar = rttvar
+        self._refresh_rto()
+    
+    def _refresh_rto(self) -> None:
+        """Recompute RTO = SRTT + max(G, 4 * RTTVAR), floored at min_rto."""
+        # G keeps the RTO above SRTT even when RTTVAR decays to ~0 on a steady path
+        self._rto = max(self.srtt + max(self._granularity, 4.0 * self.rttvar), self.min_rto)
+    
+    def get_rto(self) -> float:
+        """Get retransmission timeout (1.0 until the first sample, conservative default)."""
+        return self._rto
     
     def get_srtt(self) -> Optional[float]:
         """Get current smoothed RTT."""
@@ -68,44 +137,152 @@ class RTTTracker:
         return self.rttvar
 
 
+class RingStats:
+    """
+    Fixed-size window of floats with running sums - O(1) push and means, no allocation.
+    
+    Keeps a running total of the whole window and of the newest `recent` entries,
+    so "recent vs older" comparisons never have to copy or re-sum the window.
+    """
+    
+    __slots__ = ("size", "recent", "buf", "head", "count", "total", "recent_total")
+    
+    def __init__(self, size: int, recent: int):
+        self.size = size
+        self.recent = recent  # how many newest entries recent_total covers
+        self.buf = array("d", bytes(8 * size))
+        self.head = 0  # next slot to write
+        self.count = 0
+        self.total = 0.0
+        self.recent_total = 0.0
+    
+    def push(self, value: float) -> None:
+        """Append a value, evicting the oldest once full."""
+        buf = self.buf
+        head = self.head
+        if self.count >= self.recent:
+            # drops out of the newest `recent`
+            self.recent_total -= buf[(head - self.recent) % self.size]
+        if self.count == self.size:
+            self.total -= buf[head]
+        else:
+            self.count += 1
+        buf[head] = value
+        self.total += value
+        self.recent_total += value
+        self.head = head = (head + 1) % self.size
+        
+        if head == 0:
+            # resync once per lap so float error in the running sums can't drift
+            self.total = sum(buf)
+            self.recent_total = sum(buf[self.size - self.recent:])
+    
+    def __len__(self) -> int:
+        return self.count
+    
+    def mean(self) -> float:
+        """Mean of the whole window (0.0 if empty)."""
+        return self.total / self.count if self.count else 0.0
+    
+    def recent_mean(self) -> float:
+        """Mean of the newest `recent` entries (or fewer, if that's all we have)."""
+        return self.recent_total / min(self.recent, self.count) if self.count else 0.0
+    
+    def older_mean(self) -> float:
+        """Mean of everything except the newest `recent` entries (0.0 if there's nothing older)."""
+        return (self.total - self.recent_total) / max(1, self.count - self.recent)
+    
+    def oldest(self) -> float:
+        """Oldest entry still in the window."""
+        return self.buf[(self.head - self.count) % self.size]
+
+
 class TransferMetrics:
-    """Tracks transfer stats: throughput, delay, jitter, score."""
+    """
+    Tracks transfer stats: throughput, delay, jitter, score.
+    
+    All timestamps are time.monotonic_ns() ints - callers must pass those to
+    record_packet_*. Everything stays in integer ns until the getters.
+    """
+    
+    __slots__ = (
+        "start_time", "end_time", "total_bytes",
+        "_delay_sum", "_delay_count",
+        "last_packet_time", "_jit_n", "_jit_mean", "_jit_m2",
+    )
     
     def __init__(self):
-        self.start_time: Optional[float] = None
-        self.end_time: Optional[float] = None
-        self.packet_delays: List[float] = []  # send to ACK time
-        self.inter_packet_times: List[float] = []  # for jitter calc
-        self.last_packet_time: Optional[float] = None
+        self.start_time: Optional[int] = None
+        self.end_time: Optional[int] = None
+        # send-to-ACK delay, only the mean is reported so keep a running sum
+        self._delay_sum = 0
+        self._delay_count = 0
+        self.last_packet_time: Optional[int] = None
+        # running inter-packet time stats for jitter (Welford), no per-packet list
+        self._jit_n = 0
+        self._jit_mean = 0.0
+        self._jit_m2 = 0.0
         self.total_bytes = 0
     
     def start_transfer(self) -> None:
         """Mark transfer start."""
-        self.start_time = time.time()
+        self.start_time = time.monotonic_ns()
     
     def end_transfer(self) -> None:
         """Mark transfer end."""
-        self.end_time = time.time()
+        self.end_time = time.monotonic_ns()
     
-    def record_packet_sent(self, bytes_sent: int, send_time: float) -> None:
+    def record_packet_sent(self, bytes_sent: int, send_time: int) -> None:
         """Record packet send for throughput/jitter tracking."""
         self.total_bytes += bytes_sent
         
         if self.last_packet_time is not None:
             inter_time = send_time - self.last_packet_time
-            self.inter_packet_times.append(inter_time)
+            n = self._jit_n + 1
+            mean = self._jit_mean
+            d = inter_time - mean
+            mean += d / n
+            self._jit_m2 += d * (inter_time - mean)
+            self._jit_mean = mean
+            self._jit_n = n
         self.last_packet_time = send_time
     
-    def record_packet_acked(self, send_time: float, ack_time: float) -> None:
+    def record_batch_sent(self, bytes_sent: int, count: int, send_time: int) -> None:
+        """
+        record_packet_sent() for `count` packets (bytes_sent total) sharing one send timestamp.
+        
+        Same stats as calling it per packet, but one call per batch: the first
+        packet gets the real gap, the other count-1 gaps are all 0 and get
+        folded into the Welford state in one step (Chan's merge).
+        """
+        if count <= 0:
+            return
+        self.record_packet_sent(bytes_sent, send_time)
+        
+        rest = count - 1
+        if rest:
+            n = self._jit_n
+            mean = self._jit_mean
+            total = n + rest
+            self._jit_m2 += mean * mean * n * rest / total
+            self._jit_mean = mean - mean * rest / total
+            self._jit_n = total
+    
+    def record_packet_acked(self, send_time: int, ack_time: int) -> None:
         """Record packet ACK for delay calculation."""
-        delay = ack_time - send_time
-        self.packet_delays.append(delay)
+        self._delay_sum += ack_time - send_time
+        self._delay_count += 1
+    
+    def record_batch_acked(self, send_time_sum: int, count: int, ack_time: int) -> None:
+        """record_packet_acked() for `count` packets ACKed at once, given the sum of their send times."""
+        self._delay_sum += count * ack_time - send_time_sum
+        self._delay_count += count
     
     def get_duration(self) -> float:
         """Get total transfer duration."""
         if self.start_time is None or self.end_time is None:
             return 0.0
-        return max(self.end_time - self.start_time, 1e-6)  # avoid div by zero
+        return max((self.end_time - self.start_time) * 1e-9, 1e-6)  # avoid div by zero
     
     def get_throughput(self) -> float:
         """Calculate throughput in bytes/sec."""
@@ -116,29 +293,17 @@ class TransferMetrics:
     
     def get_avg_delay(self) -> float:
         """Average delay from send to ACK."""
-        if not self.packet_delays:
-            return 0.0
-        return sum(self.packet_delays) / len(self.packet_delays)
+        return self._delay_sum * 1e-9 / self._delay_count if self._delay_count else 0.0
     
     def get_avg_jitter(self) -> float:
         """Jitter = std dev of inter-packet times."""
-        if len(self.inter_packet_times) < 2:
+        if self._jit_n < 2:
             return 0.0
-        
-        mean = sum(self.inter_packet_times) / len(self.inter_packet_times)
-        variance = sum((x - mean) ** 2 for x in self.inter_packet_times) / len(self.inter_packet_times)
-        return variance ** 0.5
+        return (self._jit_m2 / self._jit_n) ** 0.5 * 1e-9
     
-    def get_score(self) -> float:
-        """
-        Calculate performance metric from project spec.
-        
-        Metric = (Throughput / 2000) + (15 / Average Jitter) + (35 / Average delay per packet)
-        """
-        throughput = self.get_throughput()
-        avg_delay = self.get_avg_delay()
-        avg_jitter = self.get_avg_jitter()
-        
+    @staticmethod
+    def _score(throughput: float, avg_delay: float, avg_jitter: float) -> float:
+        """Score from already-computed stats, so callers holding them don't recompute."""
         # Metric = (Throughput / 2000) + (15 / Jitter) + (35 / Delay)
         metric = (throughput / 2000.0)
         
@@ -152,12 +317,20 @@ class TransferMetrics:
         
         return metric
     
+    def get_score(self) -> float:
+        """
+        Calculate performance metric from project spec.
+        
+        Metric = (Throughput / 2000) + (15 / Average Jitter) + (35 / Average delay per packet)
+        """
+        return self._score(self.get_throughput(), self.get_avg_delay(), self.get_avg_jitter())
+    
     def format_csv(self) -> str:
         """Format as CSV: throughput,avg_delay,avg_jitter,score"""
         throughput = self.get_throughput()
         avg_delay = self.get_avg_delay()
         avg_jitter = self.get_avg_jitter()
-        score = self.get_score()
+        score = self._score(throughput, avg_delay, avg_jitter)
         
-        return f"{throughput:.7f},{avg_delay:.7f},{avg_jitter:.7f},{score:.7f}"
+        return _CSV_FMT(throughput, avg_delay, avg_jitter, score)
 
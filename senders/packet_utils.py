@@ -5,41 +5,87 @@ Packet utilities - handles all the byte packing/unpacking stuff.
 
 from __future__ import annotations
 
-from typing import Tuple
+import struct
+from typing import Optional, Tuple
 
 # packet format: 4-byte signed seq_id (big-endian) + payload
 PACKET_SIZE = 1024
 SEQ_ID_SIZE = 4
 MSS = PACKET_SIZE - SEQ_ID_SIZE  # max segment size (payload only)
 
+# receiver messages: plain ACKs say "ack", the final one says "fin"
+ACK_MSG = b"ack"
+FIN_PREFIX = b"fin"
 
-def make_packet(seq_id: int, payload: bytes) -> bytes:
-    """Build a packet: seq_id + payload."""
+# precompiled header format so pack/unpack don't re-parse it every packet
+_HDR = struct.Struct("!i")
+# header + a 3-byte message ("ack"/"fin") - unpacks the usual ACK in one call, no slicing
+_ACK_PKT = struct.Struct(f"!i{len(ACK_MSG)}s")
+
+
+def make_packet(seq_id: int, payload: bytes | memoryview) -> bytes:
+    """Build a packet: seq_id + payload (payload can be a memoryview, copied once here)."""
     # truncate if too big (shouldn't happen but be safe)
     if len(payload) > MSS:
         payload = payload[:MSS]
     
-    seq_bytes = int.to_bytes(seq_id, SEQ_ID_SIZE, byteorder="big", signed=True)
-    return seq_bytes + payload
+    return _HDR.pack(seq_id) + payload
+
+
+class PacketBuilder:
+    """
+    Builds packets into one reusable buffer instead of allocating header + payload each time.
+    
+    build() returns a view into that buffer, so it's only valid until the next
+    build() - send it right away, don't keep it around (or batch it).
+    """
+    
+    __slots__ = ("buf", "mv")
+    
+    def __init__(self):
+        self.buf = bytearray(PACKET_SIZE)
+        self.mv = memoryview(self.buf)
+    
+    def build(self, seq_id: int, payload: bytes | memoryview) -> memoryview:
+        """Write seq_id + payload (truncated to MSS) into the buffer and return a view of it."""
+        n = min(len(payload), MSS)
+        _HDR.pack_into(self.buf, 0, seq_id)
+        self.buf[SEQ_ID_SIZE:SEQ_ID_SIZE + n] = payload[:n]
+        return self.mv[:SEQ_ID_SIZE + n]
 
 
-def parse_ack(packet: bytes) -> Tuple[int, str]:
-    """Parse ACK packet from receiver. Returns (ack_id, message)."""
-    if len(packet) < SEQ_ID_SIZE:
-        raise ValueError(f"Packet too short: {len(packet)} bytes")
+def parse_ack(packet: bytes | memoryview) -> Tuple[int, Optional[bytes]]:
+    """
+    Parse ACK packet from receiver (any bytes-like, e.g. a recv buffer view).
+    
+    Returns (ack_id, message). The message is left as raw bytes (no decode per ACK)
+    and is None for a plain "ack", so the hot path can skip checking it.
+    """
+    n = len(packet)
+    if n < SEQ_ID_SIZE:
+        raise ValueError(f"Packet too short: {n} bytes")
     
-    ack_id = int.from_bytes(packet[:SEQ_ID_SIZE], byteorder="big", signed=True)
-    # ignore decode errors in case of weird bytes
-    msg = packet[SEQ_ID_SIZE:].decode(errors="ignore").strip()
+    if n == _ACK_PKT.size:
+        ack_id, msg = _ACK_PKT.unpack(packet)
+        if msg == ACK_MSG:
+            return ack_id, None
+        return ack_id, msg.strip()
+    
+    # anything else: slice a view so the message is copied once (into the result), not twice
+    ack_id = _HDR.unpack_from(packet, 0)[0]
+    return ack_id, bytes(memoryview(packet)[SEQ_ID_SIZE:]).strip()
+
+
+def parse_ack_id(packet: bytes | memoryview) -> int:
+    """
+    Just the ack_id of a receiver packet - for loops that never look at the message.
     
-    return ack_id, msg
+    Raises struct.error if the packet is shorter than the header.
+    """
+    return _HDR.unpack_from(packet, 0)[0]
 
 
-def validate_packet(packet: bytes) -> bool:
-    """Check if packet format looks valid."""
-    if len(packet) < SEQ_ID_SIZE:
-        return False
-    if len(packet) > PACKET_SIZE:
-        return False
-    return True
+def validate_packet(packet: bytes | memoryview) -> bool:
+    """Check if packet format looks valid (header present, not over PACKET_SIZE)."""
+    return SEQ_ID_SIZE <= len(packet) <= PACKET_SIZE
 
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Regression checks for CustomProtocol's loss handling (no sockets needed).
+
+Run from the repo root: python -m unittest discover tests
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import time
+import unittest
+from array import array
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if repo_root not in sys.path:
+    sys.path.insert(0, repo_root)
+
+from senders.custom_protocol import CustomProtocol
+from senders.packet_utils import MSS
+
+
+class HandleLossTest(unittest.TestCase):
+    def test_timeout_in_same_epoch_deflates_fast_recovery_window(self):
+        sender = CustomProtocol()
+        sender.cwnd = 100.0
+        sender._highest_sent_seq = 200 * MSS
+
+        # 3 dup ACKs -> fast recovery at ssthresh + 3, then more dup ACKs inflate it
+        for _ in range(3):
+            sender.on_dup_ack()
+        self.assertEqual(sender.ssthresh, 50.0)
+        self.assertEqual(sender.cwnd, 53.0)
+        for _ in range(90):
+            sender.on_dup_ack()
+        self.assertEqual(sender.cwnd, 143.0)
+
+        # timeout for a packet from the same epoch: no second ssthresh cut,
+        # but the dup-ACK inflation must not survive as the CA window
+        sender.handle_loss(is_timeout=True)
+        self.assertEqual(sender.ssthresh, 50.0)
+        self.assertEqual(sender.cwnd, 50.0)
+        self.assertEqual(sender._cwnd_int, 50)
+        self.assertFalse(sender.in_fast_recovery)
+
+
+class _RecordingSender(CustomProtocol):
+    """Records batches instead of touching a socket."""
+
+    def __init__(self):
+        super().__init__()
+        self.sent_batches = []
+
+    def _batch_send(self, idxs):
+        self.sent_batches.append(list(idxs))
+        return time.monotonic_ns()
+
+    def send_chunk(self, idx):
+        self.sent_batches.append([idx])
+        return time.monotonic_ns()
+
+
+class RetransmitExpiredTest(unittest.TestCase):
+    def test_resends_only_expired_packets_up_to_limit(self):
+        sender = _RecordingSender()
+
+        now = time.monotonic_ns()
+        stale = now - 10 * 10**9  # well past the 1s no-sample RTO
+        sender.send_times = array("q", [stale, now, stale, stale, stale])
+        sender.retrans_counts = array("B", bytes(5))
+        sender.next_seq = 5 * MSS
+
+        self.assertEqual(sender.retransmit_expired(2), 2)
+        self.assertEqual(sender.sent_batches, [[0, 2]])
+        self.assertEqual(list(sender.retrans_counts), [1, 0, 1, 0, 0])
+
+
+class DupAckAfterFullAckTest(unittest.TestCase):
+    def test_dups_of_final_ack_do_not_retransmit_or_cut_cwnd(self):
+        sender = _RecordingSender()
+        total_packets = 4
+        sender.total_bytes = total_packets * MSS
+        sender._pkt_cache = [None] * total_packets
+        sender.send_times = array("q", [time.monotonic_ns()] * total_packets)
+        sender.retrans_counts = array("B", bytes(total_packets))
+        sender.next_seq = total_packets * MSS
+        sender._highest_sent_seq = (total_packets - 1) * MSS
+
+        now = time.monotonic_ns()
+        sender.process_ack(total_packets * MSS, now)
+        self.assertEqual(sender.oldest_unacked, total_packets)
+        cwnd = sender.cwnd
+
+        for _ in range(5):
+            sender.process_ack(total_packets * MSS, now)
+        self.assertEqual(sender.sent_batches, [])
+        self.assertEqual(sender.cwnd, cwnd)
+        self.assertFalse(sender.in_fast_recovery)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Checks that the batched metric paths match their per-sample versions.
+
+Run from the repo root: python -m unittest discover tests
+"""
+
+from __future__ import annotations
+
+import os
+import random
+import sys
+import unittest
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if repo_root not in sys.path:
+    sys.path.insert(0, repo_root)
+
+from senders.metrics import RTTTracker, TransferMetrics
+
+
+class RTTUpdateBatchTest(unittest.TestCase):
+    def test_matches_repeated_update(self):
+        rng = random.Random(152)
+        samples = [rng.uniform(0.005, 0.5) for _ in range(1000)]
+
+        one_by_one = RTTTracker()
+        for sample in samples:
+            one_by_one.update(sample)
+
+        # uneven batches, including an empty one and a batch that starts from no samples
+        batched = RTTTracker()
+        batched.update_batch(samples[:3])
+        batched.update_batch([])
+        batched.update_batch(samples[3:500])
+        batched.update_batch(samples[500:])
+
+        self.assertEqual(batched.srtt, one_by_one.srtt)
+        self.assertEqual(batched.rttvar, one_by_one.rttvar)
+        self.assertEqual(batched.get_rto(), one_by_one.get_rto())
+
+    def test_empty_batch_before_first_sample_is_a_no_op(self):
+        tracker = RTTTracker()
+        tracker.update_batch([])
+        self.assertIsNone(tracker.srtt)
+        self.assertEqual(tracker.get_rto(), 1.0)
+
+
+class RecordBatchSentTest(unittest.TestCase):
+    def test_matches_per_packet_recording(self):
+        rng = random.Random(152)
+        per_packet = TransferMetrics()
+        batched = TransferMetrics()
+
+        send_time = 0
+        for _ in range(3000):
+            send_time += rng.randint(1, 100_000)
+            count = rng.randint(1, 64)
+            for _ in range(count):
+                per_packet.record_packet_sent(1020, send_time)
+            batched.record_batch_sent(1020 * count, count, send_time)
+
+        self.assertEqual(batched.total_bytes, per_packet.total_bytes)
+        self.assertEqual(batched._jit_n, per_packet._jit_n)
+        # Chan's merge vs one-at-a-time Welford - same value up to float rounding
+        self.assertAlmostEqual(batched.get_avg_jitter(), per_packet.get_avg_jitter(), delta=1e-15)
+
+    def test_empty_batch_records_nothing(self):
+        metrics = TransferMetrics()
+        metrics.record_batch_sent(0, 0, 123)
+        self.assertEqual(metrics.total_bytes, 0)
+        self.assertIsNone(metrics.last_packet_time)
+
+
+if __name__ == "__main__":
+    unittest.main()